@@ -1,11 +1,155 @@
 import io
+import logging
 from PIL import Image
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 import sys # For float('inf')
 
+try:
+    from numba import njit, prange
+except ImportError: # numba is optional; without it 2-opt falls back to a vectorized NumPy pass
+    njit = None
+    prange = range
+
+logger = logging.getLogger(__name__)
+
+
+def _two_opt_kernel(permutation: np.ndarray, cost_matrix: np.ndarray, epsilon: float) -> np.ndarray:
+    """
+    Best-improvement 2-opt over a path, reversing segments of `permutation` in place.
+    Reversing p[i+1]...p[j] replaces edges (p[i], p[i+1]) and (p[j], p[j+1]) with
+    (p[i], p[j]) and (p[i+1], p[j+1]), and flips the direction of every edge inside
+    the segment, which matters because the cost matrix is not symmetric.
+    Each pass applies the single best swap; stops when no swap improves by more than epsilon.
+    """
+    num_strips = permutation.shape[0]
+    while True:
+        best_delta = -epsilon
+        best_i = -1
+        best_j = -1
+        for i in range(num_strips - 2): # First edge is (p[i], p[i+1])
+            # Change in cost of the edges inside p[i+1]...p[j] when they are traversed backwards
+            inner_delta = 0.0
+            for j in range(i + 2, num_strips - 1): # Second edge is (p[j], p[j+1])
+                inner_delta += cost_matrix[permutation[j], permutation[j - 1]] - \
+                               cost_matrix[permutation[j - 1], permutation[j]]
+
+                cost_before = cost_matrix[permutation[i], permutation[i + 1]] + \
+                              cost_matrix[permutation[j], permutation[j + 1]]
+                cost_after = cost_matrix[permutation[i], permutation[j]] + \
+                             cost_matrix[permutation[i + 1], permutation[j + 1]]
+                delta = cost_after - cost_before + inner_delta
+
+                if delta < best_delta: # Significant improvement
+                    best_delta = delta
+                    best_i = i
+                    best_j = j
+
+        if best_i < 0:
+            return permutation
+
+        # Perform the best 2-opt swap of this pass (reverse segment in place)
+        lo, hi = best_i + 1, best_j
+        while lo < hi:
+            permutation[lo], permutation[hi] = permutation[hi], permutation[lo]
+            lo += 1
+            hi -= 1
+
+
+def _two_opt_numpy(permutation: np.ndarray, cost_matrix: np.ndarray, epsilon: float) -> np.ndarray:
+    """
+    Same search as _two_opt_kernel, but evaluates the delta of every (i, j) swap in
+    each pass at once with NumPy fancy indexing. Used when numba is unavailable.
+    """
+    num_strips = permutation.shape[0]
+    # Only j >= i + 2 gives a non-trivial segment p[i+1]...p[j]
+    invalid_pairs = ~np.triu(np.ones((num_strips - 1, num_strips - 1), dtype=bool), k=2)
+    while True:
+        a = permutation[:-1] # Edge k is (a[k], b[k]) = (p[k], p[k+1])
+        b = permutation[1:]
+        edge_cost = cost_matrix[a, b].astype(np.float64)
+        reversed_edge_cost = cost_matrix[b, a].astype(np.float64)
+
+        # inner[k] = cost change of reversing edges 0..k-1, so the change for the
+        # edges strictly inside p[i+1]...p[j] is inner[j] - inner[i+1]
+        inner = np.concatenate(([0.0], np.cumsum(reversed_edge_cost - edge_cost)))
+
+        delta = cost_matrix[a[:, None], a[None, :]] + cost_matrix[b[:, None], b[None, :]] \
+                - edge_cost[:, None] - edge_cost[None, :] \
+                + inner[None, :-1] - inner[1:, None]
+        delta[invalid_pairs] = np.inf
+
+        i, j = np.unravel_index(np.argmin(delta), delta.shape)
+        if not delta[i, j] < -epsilon:
+            return permutation
+
+        # Perform the best 2-opt swap of this pass (reverse segment in place)
+        permutation[i + 1:j + 1] = permutation[i + 1:j + 1][::-1].copy()
+
+
+if njit is not None:
+    _two_opt = njit(cache=True)(_two_opt_kernel)
+else:
+    _two_opt = _two_opt_numpy
+
+
+def _greedy_two_opt_all_starts_kernel(cost_matrix: np.ndarray, epsilon: float) -> tuple[np.ndarray, float]:
+    """
+    Builds the greedy chain from every starting strip, refines each one with 2-opt,
+    and returns the cheapest resulting path and its cost. The starts are independent,
+    so they run in parallel (prange) into per-start rows; the best is picked afterwards.
+    Only compiled with numba: calls the jitted _two_opt.
+    """
+    num_strips = cost_matrix.shape[0]
+    permutations = np.empty((num_strips, num_strips), dtype=np.int32)
+    path_costs = np.empty(num_strips, dtype=np.float64)
+
+    for start in prange(num_strips):
+        permutation = permutations[start]
+        used = np.zeros(num_strips, dtype=np.bool_)
+        permutation[0] = start
+        used[start] = True
+        last = permutation[0] # Not `start`: numba forbids rebinding the prange index
+        complete = True
+
+        for step in range(1, num_strips):
+            best_next = -1
+            min_connection_cost = np.inf
+            for k in range(num_strips):
+                if not used[k] and cost_matrix[last, k] < min_connection_cost:
+                    min_connection_cost = cost_matrix[last, k]
+                    best_next = k
+            if best_next < 0: # Chain is broken
+                complete = False
+                break
+            permutation[step] = best_next
+            used[best_next] = True
+            last = best_next
+
+        if complete:
+            _two_opt(permutation, cost_matrix, epsilon)
+            total_cost = 0.0
+            for k in range(num_strips - 1):
+                total_cost += cost_matrix[permutation[k], permutation[k + 1]]
+            path_costs[start] = total_cost
+        else:
+            path_costs[start] = np.inf
+
+    best_start = np.argmin(path_costs) # First of any ties, so the result is deterministic
+    return permutations[best_start], path_costs[best_start]
+
+
+if njit is not None:
+    _greedy_two_opt_all_starts = njit(cache=True, parallel=True)(_greedy_two_opt_all_starts_kernel)
+else:
+    _greedy_two_opt_all_starts = None
+
+
 class SurpriseManager:
     def __init__(self):
         self.epsilon = 1e-9 # Small number to prevent division by zero
+        self.exact_search_max_strips = 18 # Use branch-and-bound up to this many slices
+        self.exact_search_max_nodes = 20000 # Give up on proving optimality past this many nodes
 
     def _get_grayscale_edges_from_image_bytes(self, image_bytes: bytes) -> tuple[np.ndarray | None, np.ndarray | None, int]:
         """
@@ -17,7 +161,7 @@ class SurpriseManager:
         try:
             img_pil = Image.open(io.BytesIO(image_bytes))
             # Convert to grayscale first, then to NumPy array
-            img_pil_gray = img_pil.convert("L") # 'L' mode for grayscale
+            img_pil_gray = img_pil.convert("L") if img_pil.mode != "L" else img_pil # 'L' mode for grayscale
             img_array_gray = np.array(img_pil_gray, dtype=np.float32) # Shape: (height, width)
             
             height = img_array_gray.shape[0]
@@ -27,53 +171,46 @@ class SurpriseManager:
             
             return left_edge_gray, right_edge_gray, height
         except Exception as e:
-            print(f"Error processing image to grayscale edges: {e}")
+            logger.error("Error processing image to grayscale edges: %s", e)
             # Return None for edges to indicate failure at this stage
             return None, None, 0
 
 
-    def _calculate_ncc_cost(self, edge1_gray: np.ndarray, edge2_gray: np.ndarray) -> float:
+    def _build_ncc_cost_matrix(self, right_edges: np.ndarray, left_edges: np.ndarray) -> np.ndarray:
         """
-        Calculates cost based on Normalized Cross-Correlation (NCC) between two grayscale edges.
-        Cost = 1.0 - NCC. NCC is between -1 and 1. Cost is between 0 (perfect) and 2 (perfect inverse).
+        Calculates the cost based on Normalized Cross-Correlation (NCC) between every
+        RIGHT edge and every LEFT edge with a single matrix multiply.
+        right_edges and left_edges are float32 arrays of shape (num_slices, height).
+        Cost = 1.0 - NCC, between 0 (perfect) and 2 (perfect inverse); the diagonal is +inf.
         """
-        if edge1_gray is None or edge2_gray is None or edge1_gray.size == 0 or edge2_gray.size == 0:
-            return 2.0 # Max cost if edges are invalid
+        height = right_edges.shape[1]
 
-        mean1 = np.mean(edge1_gray)
-        mean2 = np.mean(edge2_gray)
-        
-        std1 = np.std(edge1_gray)
-        std2 = np.std(edge2_gray)
-
-        # Handle flat edges (std_dev close to zero)
-        if std1 < self.epsilon and std2 < self.epsilon: # Both are flat
-            return 0.0 if np.abs(mean1 - mean2) < self.epsilon else 1.0 # Cost 0 if same flat color, else 1
-        if std1 < self.epsilon or std2 < self.epsilon: # One is flat
-            return 1.0 # NCC is effectively 0, so cost is 1.0
-
-        numerator = np.sum((edge1_gray - mean1) * (edge2_gray - mean2))
-        denominator = std1 * std2 * edge1_gray.size # Or use (N-1)*std1*std2 if std is sample std_dev
-
-        # Using the direct formula for Pearson correlation coefficient which is equivalent to NCC for 1D signals
-        # Pearson r = cov(X, Y) / (std_dev(X) * std_dev(Y))
-        # cov(X,Y) = E[(X-EX)(Y-EY)]
-        # numerator = np.sum((edge1_gray - mean1) * (edge2_gray - mean2))
-        # denominator_sqrt_part1 = np.sqrt(np.sum((edge1_gray - mean1)**2))
-        # denominator_sqrt_part2 = np.sqrt(np.sum((edge2_gray - mean2)**2))
-        # ncc = numerator / (denominator_sqrt_part1 * denominator_sqrt_part2 + self.epsilon) # Add epsilon to avoid div by zero
-
-        # Simplified calculation of NCC for zero-mean unit-variance signals
-        norm_edge1 = (edge1_gray - mean1) / (std1 + self.epsilon)
-        norm_edge2 = (edge2_gray - mean2) / (std2 + self.epsilon)
-        ncc = np.mean(norm_edge1 * norm_edge2) # This is equivalent to Pearson correlation
+        right_mean = right_edges.mean(axis=1, keepdims=True)
+        left_mean = left_edges.mean(axis=1, keepdims=True)
+        right_std = right_edges.std(axis=1, keepdims=True)
+        left_std = left_edges.std(axis=1, keepdims=True)
+
+        # Normalize each edge once to zero mean / unit variance, so every pairwise
+        # NCC is a dot product: C[i][j] = mean(norm_right[i] * norm_left[j])
+        norm_right = (right_edges - right_mean) / (right_std + self.epsilon)
+        norm_left = (left_edges - left_mean) / (left_std + self.epsilon)
+        ncc = (norm_right @ norm_left.T) / height
 
         # Ensure NCC is within [-1, 1] due to potential floating point inaccuracies
-        ncc = np.clip(ncc, -1.0, 1.0)
-        
-        return 1.0 - ncc
+        cost_matrix = 1.0 - np.clip(ncc, -1.0, 1.0)
+
+        # Handle flat edges (std_dev close to zero): a flat edge normalizes to all
+        # zeros, giving NCC 0 and cost 1.0, except two flat edges of the same color
+        right_flat = right_std[:, 0] < self.epsilon
+        left_flat = left_std[:, 0] < self.epsilon
+        same_flat = right_flat[:, None] & left_flat[None, :] & \
+                    (np.abs(right_mean - left_mean.T) < self.epsilon)
+        cost_matrix[same_flat] = 0.0
 
-    def _calculate_total_path_cost(self, permutation: list[int], cost_matrix: list[list[float]], num_strips: int) -> float:
+        np.fill_diagonal(cost_matrix, np.inf)  # A slice cannot connect to itself
+        return cost_matrix
+
+    def _calculate_total_path_cost(self, permutation: list[int], cost_matrix: np.ndarray, num_strips: int) -> float:
         if not permutation or num_strips <= 1:
             return 0.0
         
@@ -81,53 +218,187 @@ class SurpriseManager:
         for k in range(num_strips - 1):
             idx1 = permutation[k]
             idx2 = permutation[k+1]
-            cost = cost_matrix[idx1][idx2]
+            cost = cost_matrix[idx1, idx2]
             if cost == float('inf'): # Should not happen in a valid path from greedy
                 return float('inf') 
             total_cost += cost
         return total_cost
 
-    def _apply_2_opt(self, initial_permutation: list[int], cost_matrix: list[list[float]], num_strips: int):
-        if num_strips < 4: # 2-Opt needs at least 4 nodes to make a non-trivial swap
-            return initial_permutation
+    def _assignment_permutation(self, cost_matrix: np.ndarray, num_strips: int) -> list[int] | None:
+        """
+        Solves "right edge of i -> left edge of j" as an assignment problem with the
+        Hungarian algorithm. A dummy strip (index num_strips) precedes the first and
+        follows the last strip, so a single chain through it is a full path and, as the
+        assignment is a relaxation of the path problem, the optimal one.
+        Returns that permutation, or None if the assignment splits into separate loops.
+        """
+        finite_costs = cost_matrix[np.isfinite(cost_matrix)]
+        # linear_sum_assignment needs finite costs; this exceeds any assignment avoiding it
+        forbidden_cost = (num_strips + 1) * (finite_costs.max() + 1.0)
 
-        current_permutation = list(initial_permutation)
-        
-        improved = True
-        while improved:
-            improved = False
-            min_delta = 0.0 # Track if any improvement is made
-
-            for i in range(num_strips - 2): # First edge is (p[i], p[i+1])
-                for j in range(i + 2, num_strips -1): # Second edge is (p[j], p[j+1])
-                                                      # Segment to reverse is p[i+1]...p[j]
-                    
-                    # Current cost of the two edges being considered for swap
-                    cost_before = cost_matrix[current_permutation[i]][current_permutation[i+1]] + \
-                                  cost_matrix[current_permutation[j]][current_permutation[j+1]]
-                    
-                    # Cost if we swap: p[i]->p[j] and p[i+1]->p[j+1]
-                    cost_after = cost_matrix[current_permutation[i]][current_permutation[j]] + \
-                                 cost_matrix[current_permutation[i+1]][current_permutation[j+1]]
-
-                    delta = cost_after - cost_before
-
-                    if delta < min_delta and delta < -self.epsilon : # Significant improvement
-                        # Perform the 2-opt swap (reverse segment)
-                        segment_to_reverse = current_permutation[i+1 : j+1] # Slice is exclusive at end
-                        segment_to_reverse.reverse()
-                        current_permutation = current_permutation[:i+1] + segment_to_reverse + current_permutation[j+1:]
-                        
-                        improved = True
-                        min_delta = delta # Update for "best improvement" in this pass, or just use first improvement
-                        # For "first improvement", we would break here and restart the while improved loop
-                        # For "best improvement", we continue inner loops and apply the best swap of the pass
+        augmented = np.zeros((num_strips + 1, num_strips + 1)) # Dummy row/column cost nothing
+        augmented[:num_strips, :num_strips] = np.where(np.isfinite(cost_matrix), cost_matrix, forbidden_cost)
+        augmented[num_strips, num_strips] = forbidden_cost
+
+        _, successor = linear_sum_assignment(augmented)
+
+        permutation = []
+        current = successor[num_strips]
+        while current != num_strips:
+            permutation.append(int(current))
+            current = successor[current]
+
+        if len(permutation) != num_strips:
+            return None
+        return permutation
+
+    def _greedy_permutation(self, cost_matrix: np.ndarray, num_strips: int) -> list[int]:
+        """
+        Greedy chain from every possible starting strip, always appending the unused
+        strip with the cheapest connection; returns the cheapest complete chain.
+        """
+        initial_permutation = []
+        min_overall_greedy_cost = float('inf')
+
+        # Up to 64 strips, track used strips in an int bitmask; beyond that, a boolean array
+        use_bitmask = num_strips <= 64
+        cost_rows = cost_matrix.tolist()
+
+        # Every row's candidate successors by ascending cost, sorted once. The sort is
+        # stable so ties keep the lowest index, as a left-to-right scan would.
+        successor_order = np.argsort(cost_matrix, axis=1, kind="stable").tolist()
+
+        for start_slice_original_idx in range(num_strips):
+            current_permutation_indices = [start_slice_original_idx]
+            current_total_cost = 0.0
+            used_slices_mask = 1 << start_slice_original_idx
+            available = None
+            if not use_bitmask:
+                available = np.ones(num_strips, dtype=bool)
+                available[start_slice_original_idx] = False
+            last_slice_in_chain_idx = start_slice_original_idx
+
+            # Strips only ever get used within a chain, so each row's scan can resume
+            # where it last stopped instead of starting over
+            scan_position = [0] * num_strips
+
+            while len(current_permutation_indices) < num_strips:
+                best_next_slice_idx = -1
+                min_connection_cost = float('inf')
+
+                order = successor_order[last_slice_in_chain_idx]
+                pos = scan_position[last_slice_in_chain_idx]
+                if use_bitmask:
+                    while pos < num_strips and (used_slices_mask >> order[pos]) & 1:
+                        pos += 1
+                else:
+                    while pos < num_strips and not available[order[pos]]:
+                        pos += 1
+                scan_position[last_slice_in_chain_idx] = pos
+
+                if pos < num_strips:
+                    cost = cost_rows[last_slice_in_chain_idx][order[pos]]
+                    if cost < min_connection_cost:
+                        min_connection_cost = cost
+                        best_next_slice_idx = order[pos]
             
-            # Using "first improvement" for simplicity and often faster convergence in practice
-            if improved: 
-                continue # Restart the while loop to re-evaluate from the beginning of the new path
+                if best_next_slice_idx != -1:
+                    current_permutation_indices.append(best_next_slice_idx)
+                    used_slices_mask |= 1 << best_next_slice_idx
+                    if available is not None:
+                        available[best_next_slice_idx] = False
+                    if min_connection_cost != float('inf'):
+                         current_total_cost += min_connection_cost
+                    last_slice_in_chain_idx = best_next_slice_idx
+                else:
+                    break 
+        
+            if len(current_permutation_indices) == num_strips:
+                if current_total_cost < min_overall_greedy_cost:
+                    min_overall_greedy_cost = current_total_cost
+                    initial_permutation = current_permutation_indices
+    
+        if not initial_permutation: # Fallback if greedy fails
+            logger.warning("Greedy algorithm could not form a complete permutation. Using original order for 2-Opt.")
+            initial_permutation = list(range(num_strips))
 
-        return current_permutation
+        return initial_permutation
+
+    def _branch_and_bound(self, initial_permutation: list[int], cost_matrix: np.ndarray, num_strips: int) -> list[int]:
+        """
+        Exact search over permutations by depth-first branch-and-bound, seeded with
+        `initial_permutation` as the best path so far. The bound at each node is the
+        partial path cost plus an assignment (Hungarian) relaxation of the rest: the
+        last strip and every unused strip each pick a distinct successor among the
+        unused strips or "end". If that relaxation is already a single chain it is the
+        optimal completion. Stops expanding after exact_search_max_nodes nodes and
+        returns the best path found.
+        """
+        finite_costs = cost_matrix[np.isfinite(cost_matrix)]
+        forbidden_cost = (num_strips + 1) * (finite_costs.max() + 1.0)
+        costs = np.where(np.isfinite(cost_matrix), cost_matrix, forbidden_cost).astype(np.float64)
+
+        best_permutation = list(initial_permutation)
+        best_cost = self._calculate_total_path_cost(best_permutation, costs, num_strips)
+        nodes_expanded = 0
+
+        def search(permutation: list[int], path_cost: float, remaining: list[int]):
+            nonlocal best_permutation, best_cost, nodes_expanded
+            nodes_expanded += 1
+            last = permutation[-1]
+
+            # Rows: last strip, then remaining strips; columns: remaining strips, then "end"
+            relaxed = np.zeros((len(remaining) + 1, len(remaining) + 1))
+            relaxed[:, :-1] = costs[np.ix_([last] + remaining, remaining)]
+            rows, successor = linear_sum_assignment(relaxed)
+            bound = path_cost + relaxed[rows, successor].sum()
+            if bound >= best_cost - self.epsilon:
+                return
+
+            # Nothing points back at the last strip, so following it always reaches "end"
+            completion = []
+            column = successor[0]
+            while column != len(remaining):
+                completion.append(remaining[column])
+                column = successor[column + 1]
+            if len(completion) == len(remaining):
+                best_permutation, best_cost = permutation + completion, bound
+                return
+
+            if nodes_expanded >= self.exact_search_max_nodes:
+                return
+            for next_strip in sorted(remaining, key=lambda k: costs[last, k]):
+                search(permutation + [next_strip],
+                       path_cost + costs[last, next_strip],
+                       [k for k in remaining if k != next_strip])
+
+        for start_strip in range(num_strips):
+            search([start_strip], 0.0, [k for k in range(num_strips) if k != start_strip])
+
+        return best_permutation
+
+    def _greedy_with_2_opt(self, cost_matrix: np.ndarray, num_strips: int) -> list[int]:
+        """
+        Greedy chain followed by 2-Opt refinement. With numba, every greedy start is
+        refined and the best result kept, in compiled code across all cores; without
+        it, only the cheapest greedy chain is refined.
+        """
+        if _greedy_two_opt_all_starts is not None:
+            cost_matrix = np.ascontiguousarray(cost_matrix, dtype=np.float32)
+            permutation, path_cost = _greedy_two_opt_all_starts(cost_matrix, self.epsilon)
+            if np.isfinite(path_cost):
+                return permutation.tolist()
+
+        initial_permutation = self._greedy_permutation(cost_matrix, num_strips)
+        return self._apply_2_opt(initial_permutation, cost_matrix, num_strips)
+
+    def _apply_2_opt(self, initial_permutation: list[int], cost_matrix: np.ndarray, num_strips: int):
+        if num_strips < 4: # 2-Opt needs at least 4 nodes to make a non-trivial swap
+            return initial_permutation
+
+        permutation = np.array(initial_permutation, dtype=np.int32)
+        cost_matrix = np.ascontiguousarray(cost_matrix, dtype=np.float32)
+        return _two_opt(permutation, cost_matrix, self.epsilon).tolist()
 
 
     def surprise(self, slices_bytes: list[bytes]) -> list[int]:
@@ -145,7 +416,7 @@ class SurpriseManager:
             try:
                 left_edge_gray, right_edge_gray, height = self._get_grayscale_edges_from_image_bytes(image_data_bytes)
                 if left_edge_gray is None or right_edge_gray is None or height == 0: # Check for processing failure
-                    print(f"Failed to get valid edges for slice {i}. Returning original order.")
+                    logger.error("Failed to get valid edges for slice %s. Returning original order.", i)
                     return list(range(num_slices))
 
                 # if common_height is None:
@@ -160,63 +431,28 @@ class SurpriseManager:
                     "right_edge_arr": right_edge_gray,
                 })
             except Exception as e: # Catch any other unexpected error during loop
-                print(f"Error processing slice {i} in main loop: {e}. Returning original order.")
+                logger.error("Error processing slice %s in main loop: %s. Returning original order.", i, e)
                 return list(range(num_slices))
         
         if not slice_edge_data: # Should be caught by num_slices check, but defensive
-             print("No valid slice data. Returning original order.")
+             logger.warning("No valid slice data. Returning original order.")
              return list(range(num_slices))
 
         # --- Build Dissimilarity (Cost) Matrix using NCC ---
-        dissimilarity_matrix = [[float('inf')] * num_slices for _ in range(num_slices)]
-        for i in range(num_slices):
-            for j in range(num_slices):
-                if i == j:
-                    continue
-                data_i = slice_edge_data[i] 
-                data_j = slice_edge_data[j]
-                cost = self._calculate_ncc_cost(data_i["right_edge_arr"], data_j["left_edge_arr"])
-                dissimilarity_matrix[data_i["id"]][data_j["id"]] = cost
+        right_edges = np.stack([data["right_edge_arr"] for data in slice_edge_data])
+        left_edges = np.stack([data["left_edge_arr"] for data in slice_edge_data])
+        dissimilarity_matrix = self._build_ncc_cost_matrix(right_edges, left_edges)
             
-        # --- Greedy Algorithm to find initial permutation ---
-        initial_permutation = []
-        min_overall_greedy_cost = float('inf')
+        # --- Hungarian assignment to find initial permutation ---
+        initial_permutation = self._assignment_permutation(dissimilarity_matrix, num_slices)
+        if initial_permutation is not None:
+            return initial_permutation # A single chain is already the optimal path
 
-        for start_slice_original_idx in range(num_slices):
-            current_permutation_indices = [start_slice_original_idx]
-            current_total_cost = 0.0
-            used_slices_original_indices = {start_slice_original_idx}
-            last_slice_in_chain_idx = start_slice_original_idx
+        # The optimal assignment split into separate loops; fall back to greedy + 2-Opt
+        final_permutation = self._greedy_with_2_opt(dissimilarity_matrix, num_slices)
 
-            while len(current_permutation_indices) < num_slices:
-                best_next_slice_idx = -1
-                min_connection_cost = float('inf')
-                for k_idx in range(num_slices):
-                    if k_idx not in used_slices_original_indices:
-                        cost = dissimilarity_matrix[last_slice_in_chain_idx][k_idx]
-                        if cost < min_connection_cost:
-                            min_connection_cost = cost
-                            best_next_slice_idx = k_idx
-                
-                if best_next_slice_idx != -1:
-                    current_permutation_indices.append(best_next_slice_idx)
-                    used_slices_original_indices.add(best_next_slice_idx)
-                    if min_connection_cost != float('inf'):
-                         current_total_cost += min_connection_cost
-                    last_slice_in_chain_idx = best_next_slice_idx
-                else:
-                    break 
-            
-            if len(current_permutation_indices) == num_slices:
-                if current_total_cost < min_overall_greedy_cost:
-                    min_overall_greedy_cost = current_total_cost
-                    initial_permutation = current_permutation_indices
-        
-        if not initial_permutation: # Fallback if greedy fails
-            print("Warning: Greedy algorithm could not form a complete permutation. Using original order for 2-Opt.")
-            initial_permutation = list(range(num_slices))
-        
-        # --- Apply 2-Opt Refinement ---
-        final_permutation = self._apply_2_opt(initial_permutation, dissimilarity_matrix, num_slices)
+        # --- Exact Branch-and-Bound for small inputs, seeded with the 2-Opt path ---
+        if num_slices <= self.exact_search_max_strips:
+            final_permutation = self._branch_and_bound(final_permutation, dissimilarity_matrix, num_slices)
         
         return final_permutation
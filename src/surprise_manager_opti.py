@@ -1,24 +1,47 @@
 import io
+import logging
 from PIL import Image
 import numpy as np # Import NumPy
 import sys # For float('inf')
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB # libjpeg-turbo bindings, faster than Pillow's decoder
+except ImportError: # PyTurboJPEG is optional; Pillow is used instead
+    TurboJPEG = None
+
+logger = logging.getLogger(__name__)
+
 class SurpriseManager:
     def __init__(self):
-        pass
+        self.tj = None
+        if TurboJPEG is not None:
+            try:
+                self.tj = TurboJPEG()
+            except (OSError, RuntimeError) as e: # The shared library itself is missing
+                logger.warning("TurboJPEG unavailable, falling back to Pillow: %s", e)
 
     def _get_edges_from_image_bytes(self, image_bytes: bytes) -> tuple[np.ndarray, np.ndarray, int]:
         """
-        Decodes image bytes, opens the image, converts to a NumPy array,
+        Decodes image bytes (with libjpeg-turbo when available, else Pillow) to a NumPy array,
         and extracts the leftmost and rightmost column arrays.
         Returns (left_edge_array, right_edge_array, height).
         """
         try:
-            img_pil = Image.open(io.BytesIO(image_bytes))
-            img_pil = img_pil.convert("RGB")  # Ensure image is in RGB format
-            
-            # Convert PIL Image to NumPy array
-            img_array = np.array(img_pil) # Shape: (height, width, channels)
+            img_array = None
+            if self.tj is not None:
+                try:
+                    # Decodes straight to a contiguous RGB array; no PIL image or convert()
+                    img_array = self.tj.decode(image_bytes, pixel_format=TJPF_RGB)
+                except OSError:
+                    pass # Not a JPEG libjpeg-turbo understands; let Pillow try
+
+            if img_array is None:
+                img_pil = Image.open(io.BytesIO(image_bytes))
+                if img_pil.mode != "RGB":  # Ensure image is in RGB format, skipping the copy if it already is
+                    img_pil = img_pil.convert("RGB")
+                
+                # Convert PIL Image to NumPy array
+                img_array = np.array(img_pil) # Shape: (height, width, channels)
             
             height = img_array.shape[0]
             
@@ -30,18 +53,29 @@ class SurpriseManager:
             
             return left_edge_array, right_edge_array, height
         except Exception as e:
-            print(f"Error processing image with Pillow/NumPy: {e}")
+            logger.error("Error processing image with Pillow/NumPy: %s", e)
             raise
 
-    def _calculate_edge_difference_numpy(self, edge1_array: np.ndarray, edge2_array: np.ndarray) -> float:
+    def _build_ssd_matrix(self, right_edges: np.ndarray, left_edges: np.ndarray) -> np.ndarray:
         """
-        Calculates the Sum of Absolute Differences (SAD) between two edge arrays using NumPy.
-        Assumes edge1_array and edge2_array are NumPy arrays of shape (height, channels).
+        Calculates the Sum of Squared Differences (SSD) between every RIGHT edge and every
+        LEFT edge using ||r_i||^2 + ||l_j||^2 - 2 * r_i . l_j, so the pairwise work is one
+        float32 matrix multiply. right_edges and left_edges are uint8 arrays of shape
+        (num_slices, height, channels). The diagonal is +inf (a slice cannot follow itself).
         """
-        # Ensure arrays are float32 for subtraction to prevent overflow/underflow with uint8
-        # and to ensure the result of np.sum can be a float.
-        diff = np.sum(np.abs(edge1_array.astype(np.float32) - edge2_array.astype(np.float32)))
-        return float(diff)
+        num_slices = right_edges.shape[0]
+        # Centering on mid-grey leaves every SSD unchanged but keeps the three terms
+        # small, which limits float32 cancellation error
+        right_flat = right_edges.reshape(num_slices, -1).astype(np.float32) - 128.0
+        left_flat = left_edges.reshape(num_slices, -1).astype(np.float32) - 128.0
+
+        right_norms = np.einsum("ij,ij->i", right_flat, right_flat)
+        left_norms = np.einsum("ij,ij->i", left_flat, left_flat)
+        dissimilarity_matrix = right_norms[:, None] + left_norms[None, :] - 2.0 * (right_flat @ left_flat.T)
+        np.maximum(dissimilarity_matrix, 0.0, out=dissimilarity_matrix) # Rounding can dip below zero
+
+        np.fill_diagonal(dissimilarity_matrix, np.inf)
+        return dissimilarity_matrix
 
 
     def surprise(self, slices_bytes: list[bytes]) -> list[int]:
@@ -54,7 +88,10 @@ class SurpriseManager:
         if num_slices == 1:
             return [0]
 
-        slice_edge_data = []
+        # Edges are kept as two contiguous (num_slices, height, 3) uint8 arrays,
+        # allocated once the first slice tells us the common height
+        left_edges = None
+        right_edges = None
         common_height = None
 
         for i, image_data_bytes in enumerate(slices_bytes):
@@ -64,37 +101,27 @@ class SurpriseManager:
                 
                 if common_height is None:
                     common_height = height
+                    left_edges = np.empty((num_slices,) + left_edge.shape, dtype=np.uint8)
+                    right_edges = np.empty((num_slices,) + right_edge.shape, dtype=np.uint8)
                 elif common_height != height:
-                    print(f"Warning: Slices have inconsistent heights (slice {i} has {height}, expected {common_height}).")
+                    logger.warning("Slices have inconsistent heights (slice %s has %s, expected %s).", i, height, common_height)
                     return list(range(num_slices)) # Fallback
 
-                slice_edge_data.append({
-                    "id": i,
-                    "left_edge_arr": left_edge,  # Store NumPy array
-                    "right_edge_arr": right_edge, # Store NumPy array
-                    # "height" is implicitly common_height or checked
-                })
+                left_edges[i] = left_edge
+                right_edges[i] = right_edge
             except Exception as e:
-                print(f"Error processing slice {i}: {e}. Returning original order.")
+                logger.error("Error processing slice %s: %s. Returning original order.", i, e)
                 return list(range(num_slices))
         
-        if not common_height or not slice_edge_data:
-             print("No valid slice data could be extracted. Returning original order.")
+        if not common_height:
+             logger.warning("No valid slice data could be extracted. Returning original order.")
              return list(range(num_slices))
 
-        dissimilarity_matrix = [[float('inf')] * num_slices for _ in range(num_slices)]
+        dissimilarity_matrix = self._build_ssd_matrix(right_edges, left_edges)
 
-        for i in range(num_slices):
-            for j in range(num_slices):
-                if i == j:
-                    continue
-                
-                data_i = slice_edge_data[i] 
-                data_j = slice_edge_data[j]
-                
-                # Use the new NumPy-based difference calculation
-                diff = self._calculate_edge_difference_numpy(data_i["right_edge_arr"], data_j["left_edge_arr"])
-                dissimilarity_matrix[data_i["id"]][data_j["id"]] = diff
+        # Each slice's candidate successors, cheapest first. A stable sort keeps equal
+        # costs in index order, so ties resolve exactly as a left-to-right scan would.
+        successor_order = np.argsort(dissimilarity_matrix, axis=1, kind="stable")
             
         best_overall_permutation = []
         min_overall_dissimilarity = float('inf')
@@ -102,23 +129,22 @@ class SurpriseManager:
         for start_slice_original_idx in range(num_slices):
             current_permutation_indices = [start_slice_original_idx]
             current_total_dissimilarity = 0.0 # Ensure float for costs
-            used_slices_original_indices = {start_slice_original_idx}
+            used = np.zeros(num_slices, dtype=bool)
+            used[start_slice_original_idx] = True
             last_slice_in_chain_idx = start_slice_original_idx
 
             while len(current_permutation_indices) < num_slices:
+                # The first unused entry of the sorted row is the cheapest available successor
+                candidates = successor_order[last_slice_in_chain_idx]
+                unused_positions = np.flatnonzero(~used[candidates])
                 best_next_slice_idx = -1
-                min_connection_diff = float('inf')
-
-                for k_idx in range(num_slices):
-                    if k_idx not in used_slices_original_indices:
-                        cost = dissimilarity_matrix[last_slice_in_chain_idx][k_idx]
-                        if cost < min_connection_diff:
-                            min_connection_diff = cost
-                            best_next_slice_idx = k_idx
+                if unused_positions.size:
+                    best_next_slice_idx = int(candidates[unused_positions[0]])
+                    min_connection_diff = float(dissimilarity_matrix[last_slice_in_chain_idx, best_next_slice_idx])
                 
                 if best_next_slice_idx != -1:
                     current_permutation_indices.append(best_next_slice_idx)
-                    used_slices_original_indices.add(best_next_slice_idx)
+                    used[best_next_slice_idx] = True
                     if min_connection_diff != float('inf'): # Avoid adding infinity if a path is broken
                         current_total_dissimilarity += min_connection_diff
                     last_slice_in_chain_idx = best_next_slice_idx
@@ -131,7 +157,7 @@ class SurpriseManager:
                     best_overall_permutation = current_permutation_indices
         
         if not best_overall_permutation:
-            print("Warning: Could not form a complete permutation. Returning original order.")
+            logger.warning("Could not form a complete permutation. Returning original order.")
             return list(range(num_slices))
 
         return best_overall_permutation
@@ -1,53 +1,55 @@
 import io
+import logging
+import numpy as np
 from PIL import Image # Pillow library for image processing
 import sys # For float('inf') if needed, though float('inf') is standard
 
+logger = logging.getLogger(__name__)
+
 class SurpriseManager:
     def __init__(self):
         # Initialization for your manager
         pass
 
-    def _get_edges_from_image_bytes(self, image_bytes: bytes) -> tuple[list[tuple[int, int, int]], list[tuple[int, int, int]], int]:
+    def _get_edges_from_image_bytes(self, image_bytes: bytes) -> tuple[np.ndarray, np.ndarray, int]:
         """
         Decodes image bytes, opens the image using Pillow, 
         and extracts the pixel data for its leftmost and rightmost columns.
-        Returns (left_edge_pixels, right_edge_pixels, height).
+        Returns (left_edge_pixels, right_edge_pixels, height), each edge a uint8 array of shape (height, 3).
         Corresponds to: Initial image processing and edge data extraction.
         """
         try:
             img = Image.open(io.BytesIO(image_bytes))
-            img = img.convert("RGB")  # Ensure image is in RGB format
-            width, height = img.size
-            
-            left_edge_pixels = []
-            for y in range(height):
-                left_edge_pixels.append(img.getpixel((0, y)))
-            
-            right_edge_pixels = []
-            for y in range(height):
-                right_edge_pixels.append(img.getpixel((width - 1, y)))
-            
+            if img.mode != "RGB":  # Ensure image is in RGB format, skipping the copy if it already is
+                img = img.convert("RGB")
+            img_array = np.asarray(img, dtype=np.uint8)  # Shape: (height, width, 3)
+            height = img_array.shape[0]
+
+            left_edge_pixels = img_array[:, 0, :].copy()
+            right_edge_pixels = img_array[:, -1, :].copy()
+
             return left_edge_pixels, right_edge_pixels, height
         except Exception as e:
-            print(f"Error processing image with Pillow: {e}")
+            logger.error("Error processing image with Pillow: %s", e)
             raise
 
-    def _calculate_edge_difference(self, edge1_pixels: list[tuple[int, int, int]], edge2_pixels: list[tuple[int, int, int]], height: int) -> int:
+    def _build_dissimilarity_matrix(self, right_edges: np.ndarray, left_edges: np.ndarray) -> np.ndarray:
         """
-        Calculates the Sum of Absolute Differences (SAD) between two edge pixel columns.
+        Calculates the Sum of Absolute Differences (SAD) between the RIGHT edge of every slice
+        and the LEFT edge of every slice in one broadcast, given (num_slices, height, 3) uint8 stacks.
         Corresponds to: The cost function (calculate_edge_difference in the standalone script).
         """
-        if len(edge1_pixels) != height or len(edge2_pixels) != height:
-            raise ValueError("Edge pixel lists have different heights than expected or processing failed.")
-
-        total_difference = 0
-        for i in range(height):
-            p1 = edge1_pixels[i]
-            p2 = edge2_pixels[i]
-            total_difference += abs(p1[0] - p2[0]) + \
-                                abs(p1[1] - p2[1]) + \
-                                abs(p1[2] - p2[2])
-        return total_difference
+        num_slices = right_edges.shape[0]
+        block = 64 # Rows per broadcast, bounding the block x N x height x 3 int16 temporary
+
+        # An edge SAD is at most height * 3 * 255, so int32 holds it for any realistic height
+        # and halves the bytes every greedy step reads compared with int64
+        dissimilarity_matrix = np.empty((num_slices, num_slices), dtype=np.int32)
+        for i0 in range(0, num_slices, block):
+            diff = right_edges[i0:i0 + block, None].astype(np.int16) - left_edges[None, :]
+            np.abs(diff).sum(axis=(-1, -2), dtype=np.int32, out=dissimilarity_matrix[i0:i0 + block])
+        np.fill_diagonal(dissimilarity_matrix, np.iinfo(np.int32).max) # A slice cannot follow itself
+        return dissimilarity_matrix
 
     def surprise(self, slices_bytes: list[bytes]) -> list[int]:
         """
@@ -76,7 +78,7 @@ class SurpriseManager:
                 if common_height is None:
                     common_height = height
                 elif common_height != height:
-                    print(f"Warning: Slices have inconsistent heights (slice {i} has {height}, expected {common_height}). This instance may fail.")
+                    logger.warning("Slices have inconsistent heights (slice %s has %s, expected %s). This instance may fail.", i, height, common_height)
                     return list(range(num_slices))
 
                 slice_edge_data.append({
@@ -86,53 +88,58 @@ class SurpriseManager:
                     "height": height
                 })
             except Exception as e:
-                print(f"Error processing slice {i}: {e}. Returning original order for this instance.")
+                logger.error("Error processing slice %s: %s. Returning original order for this instance.", i, e)
                 return list(range(num_slices))
         
         if not common_height or not slice_edge_data:
-             print("No valid slice data could be extracted. Returning original order.")
+             logger.warning("No valid slice data could be extracted. Returning original order.")
              return list(range(num_slices))
 
         # Step 2: Calculate Dissimilarity Matrix (Cost Matrix)
         # Corresponds to: build_cost_matrix from the standalone script.
-        dissimilarity_matrix = [[float('inf')] * num_slices for _ in range(num_slices)]
-
-        for i in range(num_slices):
-            for j in range(num_slices):
-                if i == j:
-                    continue
-                
-                data_i = slice_edge_data[i] 
-                data_j = slice_edge_data[j]
-
-                diff = self._calculate_edge_difference(data_i["right_edge"], data_j["left_edge"], common_height)
-                dissimilarity_matrix[data_i["id"]][data_j["id"]] = diff # Cost from slice i to slice j
+        right_edges = np.stack([data["right_edge"] for data in slice_edge_data])
+        left_edges = np.stack([data["left_edge"] for data in slice_edge_data])
+        dissimilarity_matrix = self._build_dissimilarity_matrix(right_edges, left_edges)
             
         # Step 3: Find the Best Permutation using a Greedy Approach
         # Corresponds to: find_best_permutation_greedy from the standalone script.
         best_overall_permutation = []
         min_overall_dissimilarity = float('inf')
+        unavailable_cost = np.iinfo(np.int32).max
+
+        # Every remaining step leaves some slice k and costs at least row_minimums[k].
+        # The steps still to come leave the chain's last slice and all but one of the
+        # unused slices, so summing those minimums (dropping the largest minimum overall,
+        # for whichever unused slice ends the chain) bounds what the chain can still cost.
+        row_minimums = dissimilarity_matrix.min(axis=1).tolist()
+        total_row_minimum = sum(row_minimums)
+        largest_row_minimum = max(row_minimums)
 
         for start_slice_original_idx in range(num_slices):
             current_permutation_indices = [start_slice_original_idx]
             current_total_dissimilarity = 0
-            used_slices_original_indices = {start_slice_original_idx}
+            used_mask = np.zeros(num_slices, dtype=bool)
+            used_mask[start_slice_original_idx] = True
             last_slice_in_chain_idx = start_slice_original_idx
+            unused_row_minimum_total = total_row_minimum - row_minimums[start_slice_original_idx]
 
             while len(current_permutation_indices) < num_slices:
-                best_next_slice_idx = -1
-                min_connection_diff = float('inf')
-
-                for k_idx in range(num_slices):
-                    if k_idx not in used_slices_original_indices:
-                        cost = dissimilarity_matrix[last_slice_in_chain_idx][k_idx]
-                        if cost < min_connection_diff:
-                            min_connection_diff = cost
-                            best_next_slice_idx = k_idx
+                # Abandon the chain once it can no longer beat the best complete one;
+                # ties never replace the best, so pruning at equality is safe
+                lower_bound = (current_total_dissimilarity + row_minimums[last_slice_in_chain_idx]
+                               + unused_row_minimum_total - largest_row_minimum)
+                if lower_bound >= min_overall_dissimilarity:
+                    break
+
+                # Cheapest unused successor in one C-level argmin (the first on ties, like a '<' scan)
+                masked_costs = np.where(used_mask, unavailable_cost, dissimilarity_matrix[last_slice_in_chain_idx])
+                best_next_slice_idx = int(masked_costs.argmin())
+                min_connection_diff = int(masked_costs[best_next_slice_idx])
                 
-                if best_next_slice_idx != -1:
+                if not used_mask[best_next_slice_idx]:
                     current_permutation_indices.append(best_next_slice_idx)
-                    used_slices_original_indices.add(best_next_slice_idx)
+                    used_mask[best_next_slice_idx] = True
+                    unused_row_minimum_total -= row_minimums[best_next_slice_idx]
                     current_total_dissimilarity += min_connection_diff
                     last_slice_in_chain_idx = best_next_slice_idx
                 else:
@@ -144,7 +151,7 @@ class SurpriseManager:
                     best_overall_permutation = current_permutation_indices
         
         if not best_overall_permutation:
-            print("Warning: Could not form a complete permutation. Returning original order.")
+            logger.warning("Could not form a complete permutation. Returning original order.")
             return list(range(num_slices))
 
         return best_overall_permutation
\ No newline at end of file